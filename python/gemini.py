@@ -6,22 +6,32 @@
 
 import json
 import time
-import hmac
+import orjson
 import hashlib
 import base64
+import codecs
 import uuid
 import threading
 import os
-import re
+import stat
+import functools
+import atexit
 import shutil
+import ssl
 import mimetypes
+import http.cookiejar
 import requests
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from requests.adapters import HTTPAdapter
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
 from dataclasses import dataclass, field
-from typing import List, Optional, Dict, Any
-from flask import Flask, request, Response, jsonify, send_from_directory, abort
+from typing import List, Optional, Dict, Any, Iterable, Iterator, Tuple
+from flask import Flask, request, Response, abort
 from flask_cors import CORS
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
 
 # 禁用SSL警告
 import urllib3
@@ -34,6 +44,33 @@ CONFIG_FILE = Path(__file__).parent / "business_gemini_session.json"
 IMAGE_CACHE_DIR = Path(__file__).parent / "image"
 IMAGE_CACHE_HOURS = 1  # 图片缓存时间（小时）
 IMAGE_CACHE_DIR.mkdir(exist_ok=True)
+IMAGE_CACHE_REAL = os.path.realpath(IMAGE_CACHE_DIR)
+IMAGE_DOWNLOAD_WORKERS = 8  # 并发下载生成图片的线程数
+IMAGE_WRITE_WORKERS = 2  # 后台写入缓存图片的线程数
+IMAGE_CLEANUP_INTERVAL = 600  # 后台清理过期图片的间隔（秒）
+STREAM_CHUNK_SIZE = 32768  # 读取流式响应的块大小（字节）
+
+# 缓存图片的扩展名由MIME类型决定，提供图片时再按扩展名还原Content-Type，无需额外保存元数据
+IMAGE_EXT_BY_MIME = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+}
+IMAGE_SEND_BLOCK_SIZE = 65536  # 读取图片文件的块大小（字节）
+IMAGE_STAT_TTL = 5  # 缓存图片文件信息的时间（秒）
+
+# 后台写入图片文件，以及尚未写完的图片 {文件名: Future}
+_image_writer = ThreadPoolExecutor(max_workers=IMAGE_WRITE_WORKERS, thread_name_prefix="image-writer")
+_pending_image_writes: Dict[str, Future] = {}
+_pending_image_lock = threading.Lock()
 
 # API endpoints
 BASE_URL = "https://biz-discoveryengine.googleapis.com/v1alpha/locations/global"
@@ -43,11 +80,77 @@ LIST_FILE_METADATA_URL = f"{BASE_URL}/widgetListSessionFileMetadata"
 ADD_CONTEXT_FILE_URL = f"{BASE_URL}/widgetAddContextFile"
 GETOXSRF_URL = "https://business.gemini.google/auth/getoxsrf"
 
+PROXY_HEALTHCHECK_INTERVAL = 300  # 后台代理检测间隔（秒），可用配置项 proxy_healthcheck_interval 覆盖
+PROXY_STARTUP_WAIT = 3  # 启动时等待首次代理检测结果的最长时间（秒）
+SIGNING_KEY_TTL = 3600  # JWT签名密钥（keyId+xsrfToken）缓存时间（秒）
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36"
+
+def _create_ssl_context() -> ssl.SSLContext:
+    """创建所有HTTPS连接共用的SSLContext
+    
+    请求均以 verify=False 发出（兼容中间人代理），这里保持同样的校验策略；
+    共用上下文可避免urllib3为每个新连接重新创建上下文并加载系统证书
+    """
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    context.set_alpn_protocols(["http/1.1"])
+    return context
+
+
+_SSL_CONTEXT = _create_ssl_context()
+
+
+class SharedTLSAdapter(HTTPAdapter):
+    """直连和代理连接都使用共享SSLContext的HTTPAdapter"""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["ssl_context"] = _SSL_CONTEXT
+        return super().init_poolmanager(*args, **kwargs)
+    
+    def proxy_manager_for(self, proxy, **proxy_kwargs):
+        proxy_kwargs["ssl_context"] = _SSL_CONTEXT
+        return super().proxy_manager_for(proxy, **proxy_kwargs)
+
+
+# 全局HTTP会话：复用连接池，避免每次请求重新进行TCP+TLS握手
+_SESSION = requests.Session()
+_SESSION.mount("https://", SharedTLSAdapter(pool_connections=32, pool_maxsize=64, max_retries=0))
+_SESSION.headers.update({
+    "accept-encoding": "gzip, deflate",
+    "user-agent": DEFAULT_USER_AGENT,
+})
+# 多账号共用会话，禁止cookie跨请求保存，避免账号之间串号
+_SESSION.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+
+_JSON_DECODER = json.JSONDecoder()
+
 # Flask应用
 app = Flask(__name__, static_folder='.')
 CORS(app)
 
 
+def json_response(obj: Any, status: int = 200) -> Response:
+    """用orjson序列化并返回JSON响应"""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+
+def stream_json_object(obj: Dict[str, Any]) -> Response:
+    """按顶层键逐个序列化并流式返回JSON对象，避免一次性生成完整响应体"""
+    items = list(obj.items())  # 先取快照，避免输出过程中配置被修改
+    
+    def generate():
+        yield b"{"
+        for i, (key, value) in enumerate(items):
+            if i:
+                yield b","
+            yield orjson.dumps(key) + b":" + orjson.dumps(value)
+        yield b"}"
+    
+    return Response(generate(), mimetype='application/json')
+
+
 class AccountManager:
     """多账号管理器，支持轮训策略"""
     
@@ -55,66 +158,245 @@ class AccountManager:
         self.config = None
         self.accounts = []  # 账号列表
         self.current_index = 0  # 当前轮训索引
-        self.account_states = {}  # 账号状态: {index: {jwt, jwt_time, session, available}}
-        self.lock = threading.Lock()
+        self._available_indices = []  # 可用账号索引快照，仅在账号增删或可用状态变化时重建
+        self.models_by_id: Dict[str, dict] = {}  # 模型ID -> 模型配置，与config["models"]同步维护
+        self.account_states = []  # 账号状态，与accounts按下标一一对应: [{jwt, jwt_time, session, available, key_bytes, key_id, key_fetch_time}]
+        self._rr_lock = threading.RLock()  # 保护轮训索引，以及账号增删/可用状态变化与可用索引的重建
+        self._config_lock = threading.Lock()  # 保护配置文件写入
+        self._dirty = threading.Event()  # 配置有未保存的修改
+        self._last_blob_hash = None  # 最近一次写入文件内容的哈希
+        self._proxy_status: Dict[str, Tuple[bool, float]] = {}  # 代理地址 -> (是否可用, 检测时间)
+        self._proxy_wakeup = threading.Event()  # 唤醒后台线程立即重新检测代理
+        self._proxy_checked = threading.Condition()  # 每次代理检测完成后通知等待方
+        threading.Thread(target=self._config_writer, name="config-writer", daemon=True).start()
+        threading.Thread(target=self._proxy_monitor, name="proxy-monitor", daemon=True).start()
+        atexit.register(self.flush_config)
+    
+    @staticmethod
+    def new_account_state(available: bool = True) -> dict:
+        """创建账号的初始运行状态"""
+        return {
+            "jwt": None,
+            "jwt_time": 0,
+            "session": None,
+            "available": available,
+            "key_bytes": None,  # 缓存的JWT签名密钥（xsrfToken解码）
+            "key_id": None,
+            "key_fetch_time": 0,
+            "signer": None,  # 由签名密钥预计算的 HmacSha256Signer，本地重签时复用
+            # 每个账号独立的锁，不同账号互不阻塞；可重入，刷新JWT失败时会在持锁状态下标记不可用
+            "lock": threading.RLock()
+        }
     
     def load_config(self):
         """加载配置"""
         if CONFIG_FILE.exists():
             with open(CONFIG_FILE, "r", encoding="utf-8") as f:
                 self.config = json.load(f)
-                self.accounts = self.config.get("accounts", [])
-                # 初始化账号状态
-                for i, acc in enumerate(self.accounts):
-                    available = acc.get("available", True)  # 默认可用
-                    self.account_states[i] = {
-                        "jwt": None,
-                        "jwt_time": 0,
-                        "session": None,
-                        "available": available
-                    }
+                self.reset_accounts()
+                self.rebuild_models_index()
+        # 代理检测交给后台线程，不阻塞启动
+        self.invalidate_proxy_status()
         return self.config
     
     def save_config(self):
-        """保存配置到文件"""
-        if self.config and CONFIG_FILE.exists():
-            with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.config, f, indent=4, ensure_ascii=False)
+        """保存配置到文件（先写临时文件再原子替换）"""
+        with self._config_lock:
+            if self.config and CONFIG_FILE.exists():
+                blob = orjson.dumps(self.config, option=orjson.OPT_INDENT_2)
+                # 内容与上次写入一致时跳过（如连续切换两次账号状态）
+                blob_hash = hashlib.blake2b(blob, digest_size=16).digest()
+                if blob_hash == self._last_blob_hash:
+                    return
+                tmp_file = CONFIG_FILE.with_suffix(".tmp")
+                # 配置中含会话Cookie：临时文件先以0600创建，再沿用原文件权限，避免替换后变为所有人可读
+                fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(blob)
+                shutil.copymode(CONFIG_FILE, tmp_file)
+                os.replace(tmp_file, CONFIG_FILE)
+                self._last_blob_hash = blob_hash
+    
+    def schedule_save(self):
+        """标记配置已修改，由后台线程合并写入，不阻塞请求"""
+        self._dirty.set()
+    
+    def flush_config(self):
+        """立即写入尚未保存的修改（进程退出时调用）"""
+        if self._dirty.is_set():
+            self._dirty.clear()
+            self.save_config()
+    
+    def _config_writer(self):
+        """后台写配置线程：短时间内的多次修改只写一次"""
+        while True:
+            self._dirty.wait()
+            time.sleep(0.5)
+            self._dirty.clear()
+            try:
+                self.save_config()
+            except Exception as e:
+                print(f"[配置] 保存失败: {e}")
     
     def mark_account_unavailable(self, index: int, reason: str = ""):
         """标记账号不可用"""
-        with self.lock:
-            if 0 <= index < len(self.accounts):
-                self.accounts[index]["available"] = False
-                self.accounts[index]["unavailable_reason"] = reason
-                self.accounts[index]["unavailable_time"] = datetime.now().isoformat()
-                self.account_states[index]["available"] = False
-                self.save_config()
-                print(f"[!] 账号 {index} 已标记为不可用: {reason}")
+        if not 0 <= index < len(self.accounts):
+            return
+        state = self.account_states[index]
+        # 加锁顺序固定为 账号锁 -> _rr_lock
+        with state["lock"], self._rr_lock:
+            # 等锁期间账号可能已被删除，下标不再对应同一个账号
+            if index >= len(self.account_states) or self.account_states[index] is not state:
+                return
+            self.accounts[index]["available"] = False
+            self.accounts[index]["unavailable_reason"] = reason
+            self.accounts[index]["unavailable_time"] = datetime.now().isoformat()
+            state["available"] = False
+            self.rebuild_available()
+        self.schedule_save()
+        print(f"[!] 账号 {index} 已标记为不可用: {reason}")
+    
+    def reset_accounts(self):
+        """根据当前config重建账号列表和状态（加载或导入配置后调用）"""
+        with self._rr_lock:
+            # 与config共用同一个列表，增删改直接反映到配置中
+            self.accounts = self.config.setdefault("accounts", [])
+            # 初始化账号状态（默认可用）
+            self.account_states = [self.new_account_state(acc.get("available", True))
+                                   for acc in self.accounts]
+            self.rebuild_available()
+    
+    def add_account(self, account: dict) -> int:
+        """添加账号，返回新账号的下标"""
+        with self._rr_lock:
+            self.accounts.append(account)
+            self.account_states.append(self.new_account_state(account.get("available", True)))
+            self.rebuild_available()
+            return len(self.accounts) - 1
+    
+    def remove_account(self, index: int) -> bool:
+        """删除账号，账号不存在时返回False"""
+        with self._rr_lock:
+            if not 0 <= index < len(self.accounts):
+                return False
+            self.accounts.pop(index)
+            self.account_states.pop(index)
+            self.rebuild_available()
+            return True
+    
+    def toggle_account(self, index: int) -> Optional[bool]:
+        """切换账号可用状态，返回切换后的状态，账号不存在时返回None"""
+        with self._rr_lock:
+            if not 0 <= index < len(self.accounts):
+                return None
+            available = not self.account_states[index]["available"]
+            self.account_states[index]["available"] = available
+            acc = self.accounts[index]
+            acc["available"] = available
+            if available:
+                # 重新启用时清除错误信息
+                acc.pop("unavailable_reason", None)
+                acc.pop("unavailable_time", None)
+            self.rebuild_available()
+            return available
+    
+    def invalidate_jwt(self, index: int):
+        """清除账号缓存的JWT和签名密钥，下次使用时重新获取"""
+        if not 0 <= index < len(self.account_states):
+            return
+        state = self.account_states[index]
+        with state["lock"]:
+            state["jwt"] = None
+            state["key_bytes"] = None
+            state["key_id"] = None
+            state["signer"] = None
     
     def get_available_accounts(self):
         """获取可用账号列表"""
-        return [(i, acc) for i, acc in enumerate(self.accounts) 
-                if self.account_states.get(i, {}).get("available", True)]
+        return [(i, acc) for i, (acc, state) in enumerate(zip(self.accounts, self.account_states))
+                if state["available"]]
+    
+    def check_proxy_now(self, proxy: Optional[str] = None) -> bool:
+        """立即检测代理（默认为当前配置的代理）并按代理地址缓存结果"""
+        if proxy is None:
+            proxy = self.config.get("proxy") if self.config else None
+        if not proxy:
+            return False
+        available = check_proxy(proxy)
+        with self._proxy_checked:
+            self._proxy_status[proxy] = (available, time.time())
+            self._proxy_checked.notify_all()
+        return available
+    
+    def invalidate_proxy_status(self):
+        """代理配置变更后使缓存的检测结果失效，并让后台线程立即重新检测"""
+        self._proxy_status.clear()
+        self._proxy_wakeup.set()
+    
+    def get_proxy_available(self) -> bool:
+        """返回后台线程缓存的当前代理检测结果，不阻塞请求"""
+        proxy = self.config.get("proxy")
+        if not proxy:
+            return False
+        return self._proxy_status.get(proxy, (False, 0.0))[0]
+    
+    def wait_proxy_status(self, timeout: float) -> Optional[bool]:
+        """等待当前代理的检测结果，超时仍未检测完成时返回None"""
+        proxy = self.config.get("proxy")
+        with self._proxy_checked:
+            if not self._proxy_checked.wait_for(lambda: proxy in self._proxy_status, timeout):
+                return None
+            return self._proxy_status[proxy][0]
+    
+    def _proxy_check_interval(self) -> float:
+        """读取代理检测间隔，配置值不是正数时使用默认值"""
+        interval = self.config.get("proxy_healthcheck_interval") if self.config else None
+        if interval is None:
+            return PROXY_HEALTHCHECK_INTERVAL
+        if isinstance(interval, bool) or not isinstance(interval, (int, float)) or not interval > 0:
+            print(f"[代理] proxy_healthcheck_interval 配置无效: {interval!r}，使用默认值 {PROXY_HEALTHCHECK_INTERVAL} 秒")
+            return PROXY_HEALTHCHECK_INTERVAL
+        return interval
+    
+    def _proxy_monitor(self):
+        """后台代理检测线程：按间隔刷新当前代理的可用状态，配置变更时立即检测"""
+        while True:
+            self._proxy_wakeup.clear()
+            try:
+                self.check_proxy_now()
+            except Exception as e:
+                print(f"[代理] 检测失败: {e}")
+            self._proxy_wakeup.wait(self._proxy_check_interval())
+    
+    def rebuild_models_index(self):
+        """重建模型ID索引（ID重复时以第一个为准，与按顺序查找的结果一致）"""
+        models_by_id = {}
+        for model in self.config.get("models", []):
+            models_by_id.setdefault(model.get("id"), model)
+        self.models_by_id = models_by_id
+    
+    def rebuild_available(self):
+        """重建可用账号索引（账号增删或可用状态变化后调用）"""
+        # 在锁内读取状态并替换，避免并发重建时旧结果覆盖新结果
+        with self._rr_lock:
+            self._available_indices = [i for i, _ in self.get_available_accounts()]
     
     def get_next_account(self):
         """轮训获取下一个可用账号"""
-        with self.lock:
-            available = self.get_available_accounts()
-            if not available:
+        with self._rr_lock:
+            if not self._available_indices:
                 raise Exception("没有可用的账号")
             
             # 轮训选择
-            self.current_index = self.current_index % len(available)
-            idx, account = available[self.current_index]
-            self.current_index = (self.current_index + 1) % len(available)
-            return idx, account
+            i = self.current_index % len(self._available_indices)
+            self.current_index = (i + 1) % len(self._available_indices)
+            idx = self._available_indices[i]
+            return idx, self.accounts[idx]
     
     def get_account_count(self):
         """获取账号数量统计"""
-        total = len(self.accounts)
-        available = len(self.get_available_accounts())
-        return total, available
+        # 可用账号索引在每次可用状态变化时已重建，直接取其长度
+        return len(self.accounts), len(self._available_indices)
 
 
 # 全局账号管理器
@@ -180,7 +462,7 @@ def check_proxy(proxy: str) -> bool:
         return False
     try:
         proxies = {"http": proxy, "https": proxy}
-        resp = requests.get("https://www.google.com", proxies=proxies, 
+        resp = _SESSION.get("https://www.google.com", proxies=proxies, 
                           verify=False, timeout=10)
         return resp.status_code == 200
     except:
@@ -194,6 +476,9 @@ def url_safe_b64encode(data: bytes) -> str:
 
 def kq_encode(s: str) -> str:
     """模拟JS的kQ函数"""
+    if s.isascii():
+        # 纯ASCII时逐字符结果与直接编码一致（JWT的JSON总是ASCII）
+        return url_safe_b64encode(s.encode('ascii'))
     byte_arr = bytearray()
     for char in s:
         val = ord(char)
@@ -213,8 +498,40 @@ def decode_xsrf_token(xsrf_token: str) -> bytes:
     return base64.urlsafe_b64decode(xsrf_token)
 
 
-def create_jwt(key_bytes: bytes, key_id: str, csesidx: str) -> str:
-    """创建JWT token"""
+# HMAC 内外层填充的字节转换表（同标准库 hmac）
+_HMAC_TRANS_36 = bytes(x ^ 0x36 for x in range(256))
+_HMAC_TRANS_5C = bytes(x ^ 0x5C for x in range(256))
+
+
+class HmacSha256Signer:
+    """预计算密钥的 HMAC-SHA256 签名器
+    
+    直接缓存 ipad/opad 两个 sha256 状态，每次签名只需 copy+update，
+    比 hmac 模块的封装少了大量Python层调用
+    """
+    __slots__ = ("_inner", "_outer")
+    
+    def __init__(self, key: bytes):
+        if len(key) > 64:
+            key = hashlib.sha256(key).digest()
+        key = key.ljust(64, b"\0")
+        self._inner = hashlib.sha256(key.translate(_HMAC_TRANS_36))
+        self._outer = hashlib.sha256(key.translate(_HMAC_TRANS_5C))
+    
+    def sign(self, message: bytes) -> bytes:
+        """返回 message 的 HMAC-SHA256 摘要"""
+        inner = self._inner.copy()
+        inner.update(message)
+        outer = self._outer.copy()
+        outer.update(inner.digest())
+        return outer.digest()
+
+
+def create_jwt(key_bytes: bytes, key_id: str, csesidx: str, signer: Optional[HmacSha256Signer] = None) -> str:
+    """创建JWT token
+    
+    signer 为预先用 key_bytes 创建的签名器，传入时复用其密钥状态
+    """
     now = int(time.time())
 
     header = {
@@ -236,14 +553,14 @@ def create_jwt(key_bytes: bytes, key_id: str, csesidx: str) -> str:
     payload_b64 = kq_encode(json.dumps(payload, separators=(',', ':')))
     message = f"{header_b64}.{payload_b64}"
 
-    signature = hmac.new(key_bytes, message.encode('utf-8'), hashlib.sha256).digest()
+    signature = (signer or HmacSha256Signer(key_bytes)).sign(message.encode('ascii'))
     signature_b64 = url_safe_b64encode(signature)
 
     return f"{message}.{signature_b64}"
 
 
-def get_jwt_for_account(account: dict, proxy: str) -> str:
-    """为指定账号获取JWT"""
+def get_signing_key_for_account(account: dict, proxy: str) -> tuple[bytes, str]:
+    """为指定账号获取JWT签名密钥，返回(key_bytes, key_id)"""
     secure_c_ses = account.get("secure_c_ses")
     host_c_oses = account.get("host_c_oses")
     csesidx = account.get("csesidx")
@@ -260,52 +577,69 @@ def get_jwt_for_account(account: dict, proxy: str) -> str:
         "cookie": f'__Secure-C_SES={secure_c_ses}; __Host-C_OSES={host_c_oses}',
     }
 
-    resp = requests.get(url, headers=headers, proxies=proxies, verify=False, timeout=30)
+    resp = _SESSION.get(url, headers=headers, proxies=proxies, verify=False, timeout=30)
 
     # 处理Google安全前缀
-    text = resp.text
-    if text.startswith(")]}'\n") or text.startswith(")]}'"): 
-        text = text[4:].strip()
+    raw = resp.content
+    if raw.startswith(b")]}'"):
+        raw = raw[4:].strip()
 
-    data = json.loads(text)
+    data = orjson.loads(raw)
     key_id = data["keyId"]
     print(f"账号: {account.get('csesidx')} 账号可用! key_id: {key_id}")
     xsrf_token = data["xsrfToken"]
 
-    key_bytes = decode_xsrf_token(xsrf_token)
+    return decode_xsrf_token(xsrf_token), key_id
 
-    return create_jwt(key_bytes, key_id, csesidx)
+
+def get_jwt_for_account(account: dict, proxy: str) -> str:
+    """为指定账号获取JWT"""
+    key_bytes, key_id = get_signing_key_for_account(account, proxy)
+    return create_jwt(key_bytes, key_id, account.get("csesidx"))
+
+
+# 调用Gemini接口的固定请求头（authorization 由 get_headers 按JWT补充）
+_STATIC_HEADERS = {
+    "accept": "*/*",
+    "accept-encoding": "gzip, deflate, br, zstd",
+    "accept-language": "zh-CN,zh;q=0.9,en;q=0.8",
+    "content-type": "application/json",
+    "origin": "https://business.gemini.google",
+    "referer": "https://business.gemini.google/",
+    "user-agent": DEFAULT_USER_AGENT,
+    "x-server-timeout": "1800",
+}
 
 
 def get_headers(jwt: str) -> dict:
     """获取请求头"""
-    return {
-        "accept": "*/*",
-        "accept-encoding": "gzip, deflate, br, zstd",
-        "accept-language": "zh-CN,zh;q=0.9,en;q=0.8",
-        "authorization": f"Bearer {jwt}",
-        "content-type": "application/json",
-        "origin": "https://business.gemini.google",
-        "referer": "https://business.gemini.google/",
-        "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/140.0.0.0 Safari/537.36",
-        "x-server-timeout": "1800",
-    }
+    headers = _STATIC_HEADERS.copy()
+    headers["authorization"] = f"Bearer {jwt}"
+    return headers
 
 
 def ensure_jwt_for_account(account_idx: int, account: dict):
     """确保指定账号的JWT有效，必要时刷新"""
     print(f"[DEBUG][ensure_jwt_for_account] 开始 - 账号索引: {account_idx}, CSESIDX: {account.get('csesidx')}")
     start_time = time.time()
-    with account_manager.lock:
-        state = account_manager.account_states[account_idx]
+    state = account_manager.account_states[account_idx]
+    with state["lock"]:
         jwt_age = time.time() - state["jwt_time"] if state["jwt"] else float('inf')
         print(f"[DEBUG][ensure_jwt_for_account] JWT状态 - 存在: {state['jwt'] is not None}, 年龄: {jwt_age:.2f}秒")
         if state["jwt"] is None or jwt_age > 240:
             print(f"[DEBUG][ensure_jwt_for_account] 需要刷新JWT...")
-            proxy = account_manager.config.get("proxy")
             try:
                 refresh_start = time.time()
-                state["jwt"] = get_jwt_for_account(account, proxy)
+                key_age = time.time() - state["key_fetch_time"] if state["key_bytes"] else float('inf')
+                if key_age > SIGNING_KEY_TTL:
+                    # 签名密钥过期或不存在，重新请求getoxsrf
+                    proxy = account_manager.config.get("proxy")
+                    state["key_bytes"], state["key_id"] = get_signing_key_for_account(account, proxy)
+                    state["signer"] = HmacSha256Signer(state["key_bytes"])
+                    state["key_fetch_time"] = time.time()
+                else:
+                    print(f"[DEBUG][ensure_jwt_for_account] 使用缓存签名密钥本地签发 - 密钥年龄: {key_age:.2f}秒")
+                state["jwt"] = create_jwt(state["key_bytes"], state["key_id"], account.get("csesidx"), state["signer"])
                 state["jwt_time"] = time.time()
                 print(f"[DEBUG][ensure_jwt_for_account] JWT刷新成功 - 耗时: {time.time() - refresh_start:.2f}秒")
             except Exception as e:
@@ -338,10 +672,10 @@ def create_chat_session(jwt: str, team_id: str, proxy: str) -> str:
     print(f"[DEBUG][create_chat_session] 使用代理: {proxy}")
     
     request_start = time.time()
-    resp = requests.post(
+    resp = _SESSION.post(
         CREATE_SESSION_URL,
         headers=get_headers(jwt),
-        json=body,
+        data=orjson.dumps(body),
         proxies=proxies,
         verify=False,
         timeout=30
@@ -354,7 +688,7 @@ def create_chat_session(jwt: str, team_id: str, proxy: str) -> str:
             print(f"[DEBUG][create_chat_session] 401错误 - 可能是team_id填错了")
         raise Exception(f"创建会话失败: {resp.status_code}")
 
-    data = resp.json()
+    data = orjson.loads(resp.content)
     session_name = data.get("session", {}).get("name")
     print(f"[DEBUG][create_chat_session] 完成 - session_name: {session_name}, 总耗时: {time.time() - start_time:.2f}秒")
     return session_name
@@ -369,8 +703,8 @@ def ensure_session_for_account(account_idx: int, account: dict):
     jwt = ensure_jwt_for_account(account_idx, account)
     print(f"[DEBUG][ensure_session_for_account] JWT获取完成 - 耗时: {time.time() - jwt_start:.2f}秒")
     
-    with account_manager.lock:
-        state = account_manager.account_states[account_idx]
+    state = account_manager.account_states[account_idx]
+    with state["lock"]:
         print(f"[DEBUG][ensure_session_for_account] 当前session状态: {state['session'] is not None}")
         if state["session"] is None:
             print(f"[DEBUG][ensure_session_for_account] 需要创建新session...")
@@ -429,10 +763,10 @@ def upload_file_to_gemini(jwt: str, session_name: str, team_id: str,
     print(f"[DEBUG][upload_file_to_gemini] 使用代理: {proxy if proxy else '无'}")
     
     request_start = time.time()
-    resp = requests.post(
+    resp = _SESSION.post(
         ADD_CONTEXT_FILE_URL,
         headers=get_headers(jwt),
-        json=body,
+        data=orjson.dumps(body),
         proxies=proxies,
         verify=False,
         timeout=60
@@ -444,7 +778,7 @@ def upload_file_to_gemini(jwt: str, session_name: str, team_id: str,
         raise Exception(f"文件上传失败: {resp.status_code} - {resp.text}")
     
     parse_start = time.time()
-    data = resp.json()
+    data = orjson.loads(resp.content)
     file_id = data.get("addContextFileResponse", {}).get("fileId")
     print(f"[DEBUG][upload_file_to_gemini] 解析响应完成 - 耗时: {time.time() - parse_start:.2f}秒")
     
@@ -462,7 +796,7 @@ def upload_file_to_gemini(jwt: str, session_name: str, team_id: str,
 class ChatImage:
     """表示生成的图片"""
     url: Optional[str] = None
-    base64_data: Optional[str] = None
+    base64_data: Optional[str] = None  # 已写入本地缓存(local_path)的图片不再保留base64副本
     mime_type: str = "image/png"
     local_path: Optional[str] = None
     file_id: Optional[str] = None
@@ -482,48 +816,82 @@ def cleanup_expired_images():
     if not IMAGE_CACHE_DIR.exists():
         return
     
-    now = time.time()
-    max_age_seconds = IMAGE_CACHE_HOURS * 3600
+    cutoff = time.time() - IMAGE_CACHE_HOURS * 3600
+    removed = False
     
-    for filepath in IMAGE_CACHE_DIR.iterdir():
-        if filepath.is_file():
+    # scandir 的目录项自带文件类型，stat 结果也会被缓存
+    with os.scandir(IMAGE_CACHE_DIR) as entries:
+        for entry in entries:
             try:
-                file_age = now - filepath.stat().st_mtime
-                if file_age > max_age_seconds:
-                    filepath.unlink()
-                    print(f"[图片缓存] 已删除过期图片: {filepath.name}")
+                if entry.is_file(follow_symlinks=False) and entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed = True
+                    print(f"[图片缓存] 已删除过期图片: {entry.name}")
             except Exception as e:
-                print(f"[图片缓存] 删除失败: {filepath.name}, 错误: {e}")
+                print(f"[图片缓存] 删除失败: {entry.name}, 错误: {e}")
+    if removed:
+        stat_cached_image.cache_clear()
+
+
+def _image_sweeper():
+    """后台清理线程：按间隔删除过期图片，请求处理时不再遍历缓存目录"""
+    while True:
+        try:
+            cleanup_expired_images()
+        except Exception as e:
+            print(f"[图片缓存] 清理失败: {e}")
+        time.sleep(IMAGE_CLEANUP_INTERVAL)
 
 
-def save_image_to_cache(image_data: bytes, mime_type: str = "image/png", filename: Optional[str] = None) -> str:
-    """保存图片到缓存目录，返回文件名"""
+def _write_image_file(filepath: Path, image_data: bytes):
+    """写入图片文件（先写临时文件再替换，避免读到写了一半的图片）"""
     IMAGE_CACHE_DIR.mkdir(exist_ok=True)
+    tmp_path = filepath.with_name(f"{filepath.name}.tmp")
+    tmp_path.write_bytes(image_data)
+    os.replace(tmp_path, filepath)
+
+
+def save_image_to_cache(image_data: bytes, mime_type: str = "image/png") -> str:
+    """保存图片到缓存目录，返回文件名
     
+    文件名由内容哈希生成，相同图片只写一次；写盘交给后台线程，调用方无需等待
+    """
     # 确定文件扩展名
-    ext_map = {
-        "image/png": ".png",
-        "image/jpeg": ".jpg",
-        "image/gif": ".gif",
-        "image/webp": ".webp",
-    }
-    ext = ext_map.get(mime_type, ".png")
-    
-    if filename:
-        # 确保有正确的扩展名
-        if not any(filename.endswith(e) for e in ext_map.values()):
-            filename = f"{filename}{ext}"
-    else:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"gemini_{timestamp}_{uuid.uuid4().hex[:8]}{ext}"
+    ext = IMAGE_EXT_BY_MIME.get(mime_type, ".png")
     
+    filename = f"{hashlib.blake2b(image_data, digest_size=12).hexdigest()}{ext}"
     filepath = IMAGE_CACHE_DIR / filename
-    with open(filepath, "wb") as f:
-        f.write(image_data)
     
+    with _pending_image_lock:
+        if filename in _pending_image_writes:
+            return filename
+        try:
+            # 已缓存过相同图片：刷新修改时间以延长缓存期
+            os.utime(filepath)
+            return filename
+        except FileNotFoundError:
+            pass
+        future = _image_writer.submit(_write_image_file, filepath, image_data)
+        _pending_image_writes[filename] = future
+    
+    def on_written(done):
+        with _pending_image_lock:
+            _pending_image_writes.pop(filename, None)
+        if done.exception():
+            print(f"[图片缓存] 写入失败: {filename}, 错误: {done.exception()}")
+    
+    future.add_done_callback(on_written)
     return filename
 
 
+def wait_image_written(filename: str):
+    """如果图片仍在后台写入，等待写入完成"""
+    with _pending_image_lock:
+        future = _pending_image_writes.get(filename)
+    if future:
+        wait([future])
+
+
 def extract_images_from_openai_content(content: Any) -> tuple[str, List[Dict]]:
     """从OpenAI格式的content中提取文本和图片
     
@@ -556,10 +924,10 @@ def extract_images_from_openai_content(content: Any) -> tuple[str, List[Dict]]:
             
             if url.startswith("data:"):
                 # base64格式: data:image/png;base64,xxxxx
-                match = re.match(r"data:([^;]+);base64,(.+)", url)
-                if match:
-                    mime_type = match.group(1)
-                    base64_data = match.group(2)
+                # 只切分头部，避免用正则扫描整段base64数据
+                head, _, base64_data = url.partition(",")
+                mime_type = head[5:].split(";", 1)[0]
+                if mime_type and head.endswith(";base64") and base64_data:
                     images.append({
                         "type": "base64",
                         "mime_type": mime_type,
@@ -578,7 +946,7 @@ def extract_images_from_openai_content(content: Any) -> tuple[str, List[Dict]]:
 def download_image_from_url(url: str, proxy: Optional[str] = None) -> tuple[bytes, str]:
     """从URL下载图片，返回(图片数据, mime_type)"""
     proxies = {"http": proxy, "https": proxy} if proxy else None
-    resp = requests.get(url, proxies=proxies, verify=False, timeout=60)
+    resp = _SESSION.get(url, proxies=proxies, verify=False, timeout=60)
     resp.raise_for_status()
     
     content_type = resp.headers.get("Content-Type", "image/png")
@@ -600,10 +968,10 @@ def get_session_file_metadata(jwt: str, session_name: str, team_id: str, proxy:
     }
     
     proxies = {"http": proxy, "https": proxy} if proxy else None
-    resp = requests.post(
+    resp = _SESSION.post(
         LIST_FILE_METADATA_URL,
         headers=get_headers(jwt),
-        json=body,
+        data=orjson.dumps(body),
         proxies=proxies,
         verify=False,
         timeout=30
@@ -613,7 +981,7 @@ def get_session_file_metadata(jwt: str, session_name: str, team_id: str, proxy:
         print(f"[图片] 获取文件元数据失败: {resp.status_code}")
         return {}
     
-    data = resp.json()
+    data = orjson.loads(resp.content)
     # 返回 fileId -> metadata 的映射
     result = {}
     file_metadata_list = data.get("listSessionFileMetadataResponse", {}).get("fileMetadata", [])
@@ -634,45 +1002,97 @@ def download_file_with_jwt(jwt: str, session_name: str, file_id: str, proxy: Opt
     url = build_download_url(session_name, file_id)
     proxies = {"http": proxy, "https": proxy} if proxy else None
     
-    resp = requests.get(
+    resp = _SESSION.get(
         url,
         headers=get_headers(jwt),
         proxies=proxies,
         verify=False,
         timeout=120,
-        allow_redirects=True
+        allow_redirects=True,
+        stream=True
     )
     
-    resp.raise_for_status()
-    content = resp.content
+    with resp:
+        resp.raise_for_status()
+        # 一次性读取响应体，不再额外拼接或复制
+        content = resp.raw.read(decode_content=True)
     
-    # 检测是否为base64编码的内容
-    try:
-        text_content = content.decode("utf-8", errors="ignore").strip()
-        if text_content.startswith("iVBORw0KGgo") or text_content.startswith("/9j/"):
-            # 是base64编码，需要解码
-            return base64.b64decode(text_content)
-    except Exception:
-        pass
+    # 只看开头几个字节判断是否为base64编码的PNG/JPEG，无需解码整个文件
+    if content[:32].lstrip().startswith((b"iVBORw0KGgo", b"/9j/")):
+        # 是base64编码，需要解码（非严格模式会忽略首尾空白，无需先strip复制）
+        try:
+            return base64.b64decode(content)
+        except Exception:
+            pass
     
     return content
 
 
-def stream_chat_with_images(jwt: str, sess_name: str, message: str, images: List[Dict], 
-                            proxy: str, team_id: str, file_ids: List[str] = None) -> ChatResponse:
-    """发送消息并流式接收响应，支持图片输入输出和文件附件
-    
-    Args:
-        jwt: JWT token
-        sess_name: 会话名称
-        message: 用户消息文本
-        images: 图片列表 [{type: 'base64'|'url', ...}]
-        proxy: 代理地址
-        team_id: 团队ID
-        file_ids: Gemini 文件ID列表（用于附带已上传的文件）
+def iter_text_chunks(resp: requests.Response, chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[str]:
+    """按块读取响应体并增量解码为文本（多字节字符可能跨块）"""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for chunk in resp.iter_content(chunk_size=chunk_size):
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator[Any]:
+    """增量解析流式返回的JSON数组，每个顶层元素完整到达后立即产出"""
+    buf = ""
+    for chunk in chunks:
+        buf += chunk
+        # 元素只可能在右花括号处结束
+        if "}" not in chunk:
+            continue
+        pos = 0
+        while True:
+            # 跳过数组括号、分隔逗号和空白
+            while pos < len(buf) and buf[pos] in "[,] \t\r\n":
+                pos += 1
+            if pos >= len(buf):
+                break
+            try:
+                obj, pos = _JSON_DECODER.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # 元素尚未接收完整
+                break
+            yield obj
+        buf = buf[pos:]
+    if buf.strip("[,] \t\r\n"):
+        # 原始内容只记录在服务端日志中，不随异常返回给客户端
+        print(f"[流式] 响应不完整，剩余内容: {buf[:200]}")
+        raise ValueError("上游响应不完整")
+
+
+def fetch_session_image(jwt: str, finfo: Dict, file_metadata: Dict, current_session: str,
+                        proxy: Optional[str] = None) -> ChatImage:
+    """下载会话中通过fileId引用的图片并保存到缓存"""
+    fid = finfo["fileId"]
+    mime = finfo["mimeType"]
+    meta = file_metadata.get(fid)
+    session_path = (meta.get("session") if meta else None) or current_session
+    
+    image_data = download_file_with_jwt(jwt, session_path, fid, proxy)
+    filename = save_image_to_cache(image_data, mime)
+    return ChatImage(
+        file_id=fid,
+        file_name=filename,
+        mime_type=mime,
+        local_path=str(IMAGE_CACHE_DIR / filename)
+    )
+
+
+def stream_chat_events(jwt: str, sess_name: str, message: str, images: List[Dict],
+                       proxy: str, team_id: str, file_ids: List[str] = None) -> Iterator[Tuple[str, Any]]:
+    """发送消息并返回增量事件迭代器，支持图片输入输出和文件附件
     
-    Returns:
-        ChatResponse 包含文本和图片
+    请求在调用时立即发出，失败直接抛出异常（便于调用方切换账号重试）；
+    返回的迭代器随上游推送逐个产出 ("text", str) 和 ("image", ChatImage)。
+    参数同 stream_chat_with_images。
     """
     # 构建查询parts
     query_parts = [{"text": message}]
@@ -693,7 +1113,7 @@ def stream_chat_with_images(jwt: str, sess_name: str, message: str, images: List
                 query_parts.append({
                     "inlineData": {
                         "mimeType": mime_type,
-                        "data": base64.b64encode(img_data).decode("utf-8")
+                        "data": base64.b64encode(img_data).decode("ascii")
                     }
                 })
             except Exception as e:
@@ -724,10 +1144,10 @@ def stream_chat_with_images(jwt: str, sess_name: str, message: str, images: List
     }
 
     proxies = {"http": proxy, "https": proxy} if proxy else None
-    resp = requests.post(
+    resp = _SESSION.post(
         STREAM_ASSIST_URL,
         headers=get_headers(jwt),
-        json=body,
+        data=orjson.dumps(body),
         proxies=proxies,
         verify=False,
         timeout=120,
@@ -735,107 +1155,132 @@ def stream_chat_with_images(jwt: str, sess_name: str, message: str, images: List
     )
 
     if resp.status_code != 200:
+        # 流式响应不会自动释放连接，失败时立即归还连接池
+        resp.close()
         raise Exception(f"请求失败: {resp.status_code}")
 
-    # 收集完整响应
-    full_response = ""
-    for line in resp.iter_lines():
-        if line:
-            full_response += line.decode('utf-8') + "\n"
+    return _iter_chat_events(resp, jwt, team_id, proxy)
 
-    # 解析响应
-    result = ChatResponse()
-    texts = []
+
+def _iter_chat_events(resp: requests.Response, jwt: str, team_id: str,
+                      proxy: Optional[str]) -> Iterator[Tuple[str, Any]]:
+    """逐个解析streamAssist返回的事件，产出文本片段和图片"""
     file_ids = []  # 收集需要下载的文件 {fileId, mimeType}
     current_session = None
+    seen_files = set()  # 缓存文件按内容命名，同一张图片只返回一次
     
-    try:
-        data_list = json.loads(full_response)
-        for data in data_list:
-            sar = data.get("streamAssistResponse")
-            if not sar:
-                continue
-            
-            # 获取session信息
-            session_info = sar.get("sessionInfo", {})
-            if session_info.get("session"):
-                current_session = session_info["session"]
-            
-            # 检查顶层的generatedImages
-            for gen_img in sar.get("generatedImages", []):
-                parse_generated_image(gen_img, result, proxy)
-            
-            answer = sar.get("answer") or {}
-            
-            # 检查answer级别的generatedImages
-            for gen_img in answer.get("generatedImages", []):
-                parse_generated_image(gen_img, result, proxy)
-            
-            for reply in answer.get("replies", []):
-                # 检查reply级别的generatedImages
-                for gen_img in reply.get("generatedImages", []):
-                    parse_generated_image(gen_img, result, proxy)
+    with resp:
+        try:
+            for data in iter_json_array(iter_text_chunks(resp)):
+                sar = data.get("streamAssistResponse")
+                if not sar:
+                    continue
                 
-                gc = reply.get("groundedContent", {})
-                content = gc.get("content", {})
-                text = content.get("text", "")
-                thought = content.get("thought", False)
+                # 本条事件中解析出的图片
+                step = ChatResponse()
                 
-                # 检查file字段（图片生成的关键）
-                file_info = content.get("file")
-                if file_info and file_info.get("fileId"):
-                    file_ids.append({
-                        "fileId": file_info["fileId"],
-                        "mimeType": file_info.get("mimeType", "image/png"),
-                        "fileName": file_info.get("name")
-                    })
+                # 获取session信息
+                session_info = sar.get("sessionInfo", {})
+                if session_info.get("session"):
+                    current_session = session_info["session"]
                 
-                # 解析图片数据
-                parse_image_from_content(content, result, proxy)
-                parse_image_from_content(gc, result, proxy)
+                # 检查顶层的generatedImages
+                for gen_img in sar.get("generatedImages", []):
+                    parse_generated_image(gen_img, step, proxy)
                 
-                # 检查attachments
-                for att in reply.get("attachments", []) + gc.get("attachments", []) + content.get("attachments", []):
-                    parse_attachment(att, result, proxy)
+                answer = sar.get("answer") or {}
                 
-                if text and not thought:
-                    texts.append(text)
-        
-        # 处理通过fileId引用的图片
-        if file_ids and current_session:
-            try:
-                file_metadata = get_session_file_metadata(jwt, current_session, team_id, proxy)
-                for finfo in file_ids:
-                    fid = finfo["fileId"]
-                    mime = finfo["mimeType"]
-                    fname = finfo.get("fileName")
-                    meta = file_metadata.get(fid)
+                # 检查answer级别的generatedImages
+                for gen_img in answer.get("generatedImages", []):
+                    parse_generated_image(gen_img, step, proxy)
+                
+                for reply in answer.get("replies", []):
+                    # 检查reply级别的generatedImages
+                    for gen_img in reply.get("generatedImages", []):
+                        parse_generated_image(gen_img, step, proxy)
+                    
+                    gc = reply.get("groundedContent", {})
+                    content = gc.get("content", {})
+                    text = content.get("text", "")
+                    thought = content.get("thought", False)
+                    
+                    # 检查file字段（图片生成的关键）
+                    file_info = content.get("file")
+                    if file_info and file_info.get("fileId"):
+                        file_ids.append({
+                            "fileId": file_info["fileId"],
+                            "mimeType": file_info.get("mimeType", "image/png"),
+                            "fileName": file_info.get("name")
+                        })
                     
-                    if meta:
-                        fname = fname or meta.get("name")
-                        session_path = meta.get("session") or current_session
-                    else:
-                        session_path = current_session
+                    # 解析图片数据
+                    parse_image_from_content(content, step, proxy)
+                    parse_image_from_content(gc, step, proxy)
                     
+                    # 检查attachments
+                    for att in reply.get("attachments", []) + gc.get("attachments", []) + content.get("attachments", []):
+                        parse_attachment(att, step, proxy)
+                    
+                    if text and not thought:
+                        yield "text", text
+                
+                for img in step.images:
+                    if img.file_name not in seen_files:
+                        seen_files.add(img.file_name)
+                        yield "image", img
+        except ValueError as e:
+            # 响应被截断或格式错误，交由调用方按失败处理，不能当作正常结束
+            print(f"[流式] 解析响应失败: {e}")
+            raise
+    
+    # 处理通过fileId引用的图片
+    if file_ids and current_session:
+        try:
+            file_metadata = get_session_file_metadata(jwt, current_session, team_id, proxy)
+            # 各文件下载互不依赖，并发下载
+            with ThreadPoolExecutor(max_workers=min(IMAGE_DOWNLOAD_WORKERS, len(file_ids))) as executor:
+                futures = {
+                    executor.submit(fetch_session_image, jwt, finfo, file_metadata, current_session, proxy): finfo["fileId"]
+                    for finfo in file_ids
+                }
+                # 按提交顺序取结果，保持上游返回的图片顺序
+                for future, file_id in futures.items():
                     try:
-                        image_data = download_file_with_jwt(jwt, session_path, fid, proxy)
-                        filename = save_image_to_cache(image_data, mime, fname)
-                        img = ChatImage(
-                            file_id=fid,
-                            file_name=filename,
-                            mime_type=mime,
-                            local_path=str(IMAGE_CACHE_DIR / filename)
-                        )
-                        result.images.append(img)
-                        print(f"[图片] 已保存: {filename}")
+                        img = future.result()
+                        print(f"[图片] 已保存: {img.file_name}")
                     except Exception as e:
-                        print(f"[图片] 下载失败 (fileId={fid}): {e}")
-            except Exception as e:
-                print(f"[图片] 获取文件元数据失败: {e}")
-                
-    except json.JSONDecodeError:
-        pass
+                        print(f"[图片] 下载失败 (fileId={file_id}): {e}")
+                        continue
+                    if img.file_name not in seen_files:
+                        seen_files.add(img.file_name)
+                        yield "image", img
+        except Exception as e:
+            print(f"[图片] 获取文件元数据失败: {e}")
+
 
+def stream_chat_with_images(jwt: str, sess_name: str, message: str, images: List[Dict], 
+                            proxy: str, team_id: str, file_ids: List[str] = None) -> ChatResponse:
+    """发送消息并流式接收响应，支持图片输入输出和文件附件
+    
+    Args:
+        jwt: JWT token
+        sess_name: 会话名称
+        message: 用户消息文本
+        images: 图片列表 [{type: 'base64'|'url', ...}]
+        proxy: 代理地址
+        team_id: 团队ID
+        file_ids: Gemini 文件ID列表（用于附带已上传的文件）
+    
+    Returns:
+        ChatResponse 包含文本和图片
+    """
+    result = ChatResponse()
+    texts = []
+    for kind, payload in stream_chat_events(jwt, sess_name, message, images, proxy, team_id, file_ids):
+        if kind == "text":
+            texts.append(payload)
+        else:
+            result.images.append(payload)
     result.text = "".join(texts)
     return result
 
@@ -854,7 +1299,6 @@ def parse_generated_image(gen_img: Dict, result: ChatResponse, proxy: Optional[s
             mime_type = image_data.get("mimeType", "image/png")
             filename = save_image_to_cache(decoded, mime_type)
             img = ChatImage(
-                base64_data=b64_data,
                 mime_type=mime_type,
                 file_name=filename,
                 local_path=str(IMAGE_CACHE_DIR / filename)
@@ -877,7 +1321,6 @@ def parse_image_from_content(content: Dict, result: ChatResponse, proxy: Optiona
                 mime_type = inline_data.get("mimeType", "image/png")
                 filename = save_image_to_cache(decoded, mime_type)
                 img = ChatImage(
-                    base64_data=b64_data,
                     mime_type=mime_type,
                     file_name=filename,
                     local_path=str(IMAGE_CACHE_DIR / filename)
@@ -900,10 +1343,8 @@ def parse_attachment(att: Dict, result: ChatResponse, proxy: Optional[str] = Non
     if b64_data:
         try:
             decoded = base64.b64decode(b64_data)
-            filename = att.get("name") or None
-            filename = save_image_to_cache(decoded, mime_type, filename)
+            filename = save_image_to_cache(decoded, mime_type)
             img = ChatImage(
-                base64_data=b64_data,
                 mime_type=mime_type,
                 file_name=filename,
                 local_path=str(IMAGE_CACHE_DIR / filename)
@@ -945,7 +1386,7 @@ def list_models():
             "parent": None
         })
     
-    return jsonify({"object": "list", "data": models_data})
+    return json_response({"object": "list", "data": models_data})
 
 
 @app.route('/v1/files', methods=['POST'])
@@ -963,12 +1404,12 @@ def upload_file():
         print(f"[文件上传] 步骤1: 检查请求中的文件...")
         if 'file' not in request.files:
             print(f"[文件上传] 错误: 请求中没有文件")
-            return jsonify({"error": {"message": "No file provided", "type": "invalid_request_error"}}), 400
+            return json_response({"error": {"message": "No file provided", "type": "invalid_request_error"}}, 400)
         
         file = request.files['file']
         if file.filename == '':
             print(f"[文件上传] 错误: 文件名为空")
-            return jsonify({"error": {"message": "No file selected", "type": "invalid_request_error"}}), 400
+            return json_response({"error": {"message": "No file selected", "type": "invalid_request_error"}}, 400)
         print(f"[文件上传] 步骤1完成: 文件名={file.filename}, 耗时={time.time()-step_start:.3f}秒")
         
         # 获取文件内容和MIME类型
@@ -987,6 +1428,7 @@ def upload_file():
         for retry_idx in range(max_retries):
             retry_start = time.time()
             print(f"\n[文件上传] --- 第{retry_idx+1}次尝试 ---")
+            account_idx = None
             try:
                 # 获取账号
                 step_start = time.time()
@@ -1032,7 +1474,7 @@ def upload_file():
                     print(f"{'='*60}\n")
                     
                     # 返回 OpenAI 格式响应
-                    return jsonify({
+                    return json_response({
                         "id": openai_file_id,
                         "object": "file",
                         "bytes": len(file_content),
@@ -1048,6 +1490,8 @@ def upload_file():
                 print(f"[文件上传] 第{retry_idx+1}次尝试失败: {type(e).__name__}: {e}")
                 print(f"[文件上传] 堆栈跟踪:\n{traceback.format_exc()}")
                 print(f"[文件上传] 本次尝试耗时: {time.time()-retry_start:.3f}秒")
+                if account_idx is not None:
+                    account_manager.invalidate_jwt(account_idx)
                 continue
         
         total_time = time.time() - request_start_time
@@ -1055,7 +1499,7 @@ def upload_file():
         print(f"[文件上传] 最后错误: {last_error}")
         print(f"[文件上传] 总耗时: {total_time:.3f}秒")
         print(f"{'='*60}\n")
-        return jsonify({"error": {"message": f"文件上传失败: {last_error}", "type": "api_error"}}), 500
+        return json_response({"error": {"message": f"文件上传失败: {last_error}", "type": "api_error"}}, 500)
         
     except Exception as e:
         total_time = time.time() - request_start_time
@@ -1065,14 +1509,14 @@ def upload_file():
         print(f"[文件上传] 堆栈跟踪:\n{traceback.format_exc()}")
         print(f"[文件上传] 总耗时: {total_time:.3f}秒")
         print(f"{'='*60}\n")
-        return jsonify({"error": {"message": str(e), "type": "api_error"}}), 500
+        return json_response({"error": {"message": str(e), "type": "api_error"}}, 500)
 
 
 @app.route('/v1/files', methods=['GET'])
 def list_files():
     """获取已上传文件列表"""
     files = file_manager.list_files()
-    return jsonify({
+    return json_response({
         "object": "list",
         "data": [{
             "id": f["openai_file_id"],
@@ -1090,9 +1534,9 @@ def get_file(file_id):
     """获取文件信息"""
     file_info = file_manager.get_file(file_id)
     if not file_info:
-        return jsonify({"error": {"message": "File not found", "type": "invalid_request_error"}}), 404
+        return json_response({"error": {"message": "File not found", "type": "invalid_request_error"}}, 404)
     
-    return jsonify({
+    return json_response({
         "id": file_info["openai_file_id"],
         "object": "file",
         "bytes": file_info.get("size", 0),
@@ -1106,21 +1550,18 @@ def get_file(file_id):
 def delete_file(file_id):
     """删除文件"""
     if file_manager.delete_file(file_id):
-        return jsonify({
+        return json_response({
             "id": file_id,
             "object": "file",
             "deleted": True
         })
-    return jsonify({"error": {"message": "File not found", "type": "invalid_request_error"}}), 404
+    return json_response({"error": {"message": "File not found", "type": "invalid_request_error"}}, 404)
 
 
 @app.route('/v1/chat/completions', methods=['POST'])
 def chat_completions():
     """聊天对话接口（支持图片输入输出）"""
     try:
-        # 每次请求时清理过期图片
-        cleanup_expired_images()
-        
         data = request.json
         messages = data.get('messages', [])
         stream = data.get('stream', False)
@@ -1166,14 +1607,16 @@ def chat_completions():
         print(f"[调试] 转换后的Gemini文件ID: {gemini_file_ids}")
         
         if not user_message and not input_images and not gemini_file_ids:
-            return jsonify({"error": "No user message found"}), 400
+            return json_response({"error": "No user message found"}, 400)
         
         # 轮训获取账号
         max_retries = len(account_manager.accounts)
         last_error = None
         chat_response = None
+        chat_events = None
         
         for _ in range(max_retries):
+            account_idx = None
             try:
                 account_idx, account = account_manager.get_next_account()
                 csesidx = account.get("csesidx", "unknown")
@@ -1182,53 +1625,76 @@ def chat_completions():
                 proxy = account_manager.config.get("proxy")
                 
                 # 发送请求（支持图片和文件）
-                chat_response = stream_chat_with_images(jwt, session, user_message, input_images, proxy, team_id, gemini_file_ids)
+                if stream:
+                    # 流式请求只在此处确认上游已成功响应，内容边接收边转发
+                    chat_events = stream_chat_events(jwt, session, user_message, input_images, proxy, team_id, gemini_file_ids)
+                else:
+                    chat_response = stream_chat_with_images(jwt, session, user_message, input_images, proxy, team_id, gemini_file_ids)
                 break
             except Exception as e:
                 last_error = e
+                if account_idx is not None:
+                    # 签名密钥可能已轮换，下次使用该账号时重新获取
+                    account_manager.invalidate_jwt(account_idx)
                 continue
         else:
             # 所有账号都失败
-            return jsonify({"error": f"所有账号请求失败: {last_error}"}), 500
-
-        # 构建响应内容（包含图片）
-        response_content = build_openai_response_content(chat_response, request.host_url)
+            return json_response({"error": f"所有账号请求失败: {last_error}"}, 500)
 
         if stream:
-            # 流式响应
+            # 流式响应：上游每到一段文本就转发，图片URL在文本结束后追加
+            base_url = get_image_base_url(request.host_url)
+            
             def generate():
                 chunk_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
-                chunk = {
-                    "id": chunk_id,
-                    "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model": "gemini-enterprise",
-                    "choices": [{
-                        "index": 0,
-                        "delta": {"content": response_content},
-                        "finish_reason": None
-                    }]
-                }
-                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
                 
-                # 结束标记
-                end_chunk = {
-                    "id": chunk_id,
-                    "object": "chat.completion.chunk",
-                    "created": int(time.time()),
-                    "model": "gemini-enterprise",
-                    "choices": [{
-                        "index": 0,
-                        "delta": {},
-                        "finish_reason": "stop"
-                    }]
-                }
-                yield f"data: {json.dumps(end_chunk, ensure_ascii=False)}\n\n"
+                def sse_chunk(delta: dict, finish_reason: Optional[str] = None) -> str:
+                    chunk = {
+                        "id": chunk_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": "gemini-enterprise",
+                        "choices": [{
+                            "index": 0,
+                            "delta": delta,
+                            "finish_reason": finish_reason
+                        }]
+                    }
+                    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                
+                has_text = False
+                image_urls = []
+                stream_error = None
+                try:
+                    for kind, payload in chat_events:
+                        if kind == "text":
+                            has_text = True
+                            yield sse_chunk({"content": payload})
+                        elif payload.file_name:
+                            image_urls.append(f"{base_url}image/{payload.file_name}")
+                except Exception as e:
+                    # 已开始输出，无法再切换账号，只能提前结束
+                    print(f"[流式] 转发响应中断: {e}")
+                    stream_error = e
+                
+                if image_urls:
+                    tail = "\n".join(image_urls)
+                    yield sse_chunk({"content": f"\n\n{tail}" if has_text else tail})
+                
+                if stream_error is not None:
+                    # 明确告知客户端响应不完整，避免把截断的回答当作正常结束（详细原因仅记录在服务端）
+                    error = {"error": {"message": "upstream response truncated", "type": "api_error"}}
+                    yield f"data: {json.dumps(error)}\n\n"
+                else:
+                    # 结束标记
+                    yield sse_chunk({}, "stop")
                 yield "data: [DONE]\n\n"
 
-            return Response(generate(), mimetype='text/event-stream')
+            return Response(generate(), mimetype='text/event-stream',
+                            headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"})
         else:
             # 非流式响应
+            response_content = build_openai_response_content(chat_response, request.host_url)
             response = {
                 "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
                 "object": "chat.completion",
@@ -1248,12 +1714,12 @@ def chat_completions():
                     "total_tokens": len(user_message) + len(chat_response.text)
                 }
             }
-            return jsonify(response)
+            return json_response(response)
 
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 
 def get_image_base_url(fallback_host_url: str) -> str:
@@ -1280,53 +1746,93 @@ def build_openai_response_content(chat_response: ChatResponse, host_url: str) ->
     # 如果有图片，将图片URL追加到文本中
     if chat_response.images:
         base_url = get_image_base_url(host_url)
-        image_urls = []
-        
-        for img in chat_response.images:
-            if img.file_name:
-                image_url = f"{base_url}image/{img.file_name}"
-                image_urls.append(image_url)
-        
-        if image_urls:
+        tail = "\n".join(f"{base_url}image/{img.file_name}"
+                         for img in chat_response.images if img.file_name)
+        if tail:
             # 在文本末尾添加图片URL
-            if result_text:
-                result_text += "\n\n"
-            result_text += "\n".join(image_urls)
+            result_text = f"{result_text}\n\n{tail}" if result_text else tail
     
     return result_text
 
 
 # ==================== 图片服务接口 ====================
 
+@functools.lru_cache(maxsize=4096)
+def stat_cached_image(filename: str, bucket: int) -> Optional[Tuple[str, int, int, str]]:
+    """获取缓存图片的 (真实路径, 大小, 修改时间ns, Content-Type)，不存在或越界时返回None
+    
+    bucket 为按 IMAGE_STAT_TTL 划分的时间段，同一时间段内重复访问不再stat
+    """
+    try:
+        # 安全检查：解析后的真实路径必须位于缓存目录内，防止路径遍历
+        real = os.path.realpath(os.path.join(IMAGE_CACHE_REAL, filename))
+        if not real.startswith(IMAGE_CACHE_REAL + os.sep):
+            return None
+        st = os.stat(real)
+    except (OSError, ValueError):
+        # 文件不存在、无法访问或文件名非法（如包含空字符）
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    mime_type = MIME_TYPES.get(os.path.splitext(filename)[1].lower(), 'application/octet-stream')
+    return real, st.st_size, st.st_mtime_ns, mime_type
+
+
 @app.route('/image/<path:filename>')
 def serve_image(filename):
     """提供缓存图片的访问"""
-    # 安全检查：防止路径遍历
-    if '..' in filename or filename.startswith('/'):
+    # 刚生成的图片可能仍在后台写入
+    wait_image_written(filename)
+    info = stat_cached_image(filename, int(time.monotonic() // IMAGE_STAT_TTL))
+    if info is None:
         abort(404)
+    real, size, mtime_ns, mime_type = info
     
-    filepath = IMAGE_CACHE_DIR / filename
-    if not filepath.exists():
-        abort(404)
+    etag = f"{mtime_ns:x}-{size:x}"
+    last_modified = datetime.fromtimestamp(mtime_ns / 1e9, timezone.utc)
+    headers = {"Cache-Control": f"public, max-age={IMAGE_CACHE_HOURS * 3600}"}
     
-    # 确定Content-Type
-    ext = filepath.suffix.lower()
-    mime_types = {
-        '.png': 'image/png',
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.gif': 'image/gif',
-        '.webp': 'image/webp',
-    }
-    mime_type = mime_types.get(ext, 'application/octet-stream')
+    # 客户端已有相同版本（If-None-Match / If-Modified-Since），不打开文件直接返回304
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
     
-    return send_from_directory(IMAGE_CACHE_DIR, filename, mimetype=mime_type)
+    # 交给WSGI服务器的 wsgi.file_wrapper（支持时走sendfile零拷贝）
+    try:
+        fp = open(real, 'rb')
+    except FileNotFoundError:
+        # 缓存的文件信息已过时（图片已被清理）
+        abort(404)
+    response = Response(wrap_file(request.environ, fp, IMAGE_SEND_BLOCK_SIZE),
+                        mimetype=mime_type, headers=headers, direct_passthrough=True)
+    response.content_length = size
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # 处理Range请求（206分段返回）
+    try:
+        return response.make_conditional(request, accept_ranges=True, complete_length=size)
+    except RequestedRangeNotSatisfiable:
+        fp.close()
+        raise
+
+
+HEALTH_CACHE_TTL = 0.5  # 健康检查响应的缓存时间（秒）
+_health_cache = (0.0, b"")  # (生成时间, 序列化后的响应体)
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """健康检查"""
-    return jsonify({"status": "ok", "timestamp": datetime.now().isoformat()})
+    global _health_cache
+    now = time.time()
+    cached_at, body = _health_cache
+    # 负载均衡器高频探测，短时间内直接复用已序列化的响应体
+    if now - cached_at > HEALTH_CACHE_TTL:
+        body = orjson.dumps({"status": "ok", "timestamp": datetime.fromtimestamp(now).isoformat()})
+        _health_cache = (now, body)
+    return Response(body, mimetype='application/json')
 
 
 @app.route('/api/status', methods=['GET'])
@@ -1335,7 +1841,7 @@ def system_status():
     total, available = account_manager.get_account_count()
     proxy = account_manager.config.get("proxy")
     
-    return jsonify({
+    return json_response({
         "status": "ok",
         "timestamp": datetime.now().isoformat(),
         "accounts": {
@@ -1344,7 +1850,7 @@ def system_status():
         },
         "proxy": {
             "url": proxy,
-            "available": check_proxy(proxy) if proxy else False
+            "available": account_manager.get_proxy_available() if proxy else False
         },
         "models": account_manager.config.get("models", [])
     })
@@ -1352,35 +1858,59 @@ def system_status():
 
 # ==================== 管理接口 ====================
 
+# 更新接口允许修改的字段
+_ACCOUNT_FIELDS = frozenset({"team_id", "secure_c_ses", "host_c_oses", "csesidx", "user_agent"})
+_MODEL_FIELDS = frozenset({"name", "description", "context_length", "max_tokens", "enabled"})
+
+PAGE_CACHE_MAX_AGE = 60  # 管理页面的浏览器缓存时间（秒）
+_page_cache: Dict[str, Tuple[bytes, str]] = {}  # 页面文件名 -> (内容, ETag)
+
+
+def serve_cached_page(name: str) -> Response:
+    """从内存返回静态页面，首次访问时读取文件"""
+    page = _page_cache.get(name)
+    if page is None:
+        try:
+            body = (Path(__file__).parent / name).read_bytes()
+        except FileNotFoundError:
+            abort(404)
+        page = _page_cache[name] = (body, hashlib.blake2b(body, digest_size=16).hexdigest())
+    body, etag = page
+    headers = {"Cache-Control": f"public, max-age={PAGE_CACHE_MAX_AGE}"}
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        response = Response(body, mimetype='text/html', headers=headers)
+    response.set_etag(etag)
+    return response
+
+
 @app.route('/')
 def index():
     """返回管理页面"""
-    return send_from_directory('.', 'index.html')
+    return serve_cached_page('index.html')
 
 @app.route('/chat_history.html')
 def chat_history():
     """返回聊天记录页面"""
-    return send_from_directory('.', 'chat_history.html')
+    return serve_cached_page('chat_history.html')
 
 @app.route('/api/accounts', methods=['GET'])
 def get_accounts():
     """获取账号列表"""
-    accounts_data = []
-    for i, acc in enumerate(account_manager.accounts):
-        state = account_manager.account_states.get(i, {})
-        # 返回完整值用于编辑，前端显示时再截断
-        accounts_data.append({
-            "id": i,
-            "team_id": acc.get("team_id", ""),
-            "secure_c_ses": acc.get("secure_c_ses", ""),
-            "host_c_oses": acc.get("host_c_oses", ""),
-            "csesidx": acc.get("csesidx", ""),
-            "user_agent": acc.get("user_agent", ""),
-            "available": state.get("available", True),
-            "unavailable_reason": acc.get("unavailable_reason", ""),
-            "has_jwt": state.get("jwt") is not None
-        })
-    return jsonify({"accounts": accounts_data})
+    # 返回完整值用于编辑，前端显示时再截断
+    accounts_data = [{
+        "id": i,
+        "team_id": acc.get("team_id", ""),
+        "secure_c_ses": acc.get("secure_c_ses", ""),
+        "host_c_oses": acc.get("host_c_oses", ""),
+        "csesidx": acc.get("csesidx", ""),
+        "user_agent": acc.get("user_agent", ""),
+        "available": state["available"],
+        "unavailable_reason": acc.get("unavailable_reason", ""),
+        "has_jwt": state["jwt"] is not None
+    } for i, (acc, state) in enumerate(zip(account_manager.accounts, account_manager.account_states))]
+    return json_response({"accounts": accounts_data})
 
 
 @app.route('/api/accounts', methods=['POST'])
@@ -1396,108 +1926,67 @@ def add_account():
         "available": True
     }
     
-    account_manager.accounts.append(new_account)
-    idx = len(account_manager.accounts) - 1
-    account_manager.account_states[idx] = {
-        "jwt": None,
-        "jwt_time": 0,
-        "session": None,
-        "available": True
-    }
-    account_manager.config["accounts"] = account_manager.accounts
-    account_manager.save_config()
+    idx = account_manager.add_account(new_account)
+    account_manager.schedule_save()
     
-    return jsonify({"success": True, "id": idx})
+    return json_response({"success": True, "id": idx})
 
 
 @app.route('/api/accounts/<int:account_id>', methods=['PUT'])
 def update_account(account_id):
     """更新账号"""
     if account_id < 0 or account_id >= len(account_manager.accounts):
-        return jsonify({"error": "账号不存在"}), 404
+        return json_response({"error": "账号不存在"}, 404)
     
     data = request.json
-    acc = account_manager.accounts[account_id]
-    
-    if "team_id" in data:
-        acc["team_id"] = data["team_id"]
-    if "secure_c_ses" in data:
-        acc["secure_c_ses"] = data["secure_c_ses"]
-    if "host_c_oses" in data:
-        acc["host_c_oses"] = data["host_c_oses"]
-    if "csesidx" in data:
-        acc["csesidx"] = data["csesidx"]
-    if "user_agent" in data:
-        acc["user_agent"] = data["user_agent"]
-    
-    # 同步更新config中的accounts
-    account_manager.config["accounts"] = account_manager.accounts
-    account_manager.save_config()
-    return jsonify({"success": True})
+    account_manager.accounts[account_id].update({k: v for k, v in data.items() if k in _ACCOUNT_FIELDS})
+    # 凭据可能已变更，丢弃缓存的JWT和签名密钥
+    account_manager.invalidate_jwt(account_id)
+    account_manager.schedule_save()
+    return json_response({"success": True})
 
 
 @app.route('/api/accounts/<int:account_id>', methods=['DELETE'])
 def delete_account(account_id):
     """删除账号"""
-    if account_id < 0 or account_id >= len(account_manager.accounts):
-        return jsonify({"error": "账号不存在"}), 404
-    
-    account_manager.accounts.pop(account_id)
-    # 重建状态映射
-    new_states = {}
-    for i in range(len(account_manager.accounts)):
-        if i < account_id:
-            new_states[i] = account_manager.account_states.get(i, {})
-        else:
-            new_states[i] = account_manager.account_states.get(i + 1, {})
-    account_manager.account_states = new_states
-    account_manager.config["accounts"] = account_manager.accounts
-    account_manager.save_config()
+    if not account_manager.remove_account(account_id):
+        return json_response({"error": "账号不存在"}, 404)
+    account_manager.schedule_save()
     
-    return jsonify({"success": True})
+    return json_response({"success": True})
 
 
 @app.route('/api/accounts/<int:account_id>/toggle', methods=['POST'])
 def toggle_account(account_id):
     """切换账号状态"""
-    if account_id < 0 or account_id >= len(account_manager.accounts):
-        return jsonify({"error": "账号不存在"}), 404
-    
-    state = account_manager.account_states.get(account_id, {})
-    current = state.get("available", True)
-    state["available"] = not current
-    account_manager.accounts[account_id]["available"] = not current
-    
-    if not current:
-        # 重新启用时清除错误信息
-        account_manager.accounts[account_id].pop("unavailable_reason", None)
-        account_manager.accounts[account_id].pop("unavailable_time", None)
-    
-    account_manager.save_config()
-    return jsonify({"success": True, "available": not current})
+    available = account_manager.toggle_account(account_id)
+    if available is None:
+        return json_response({"error": "账号不存在"}, 404)
+    account_manager.schedule_save()
+    return json_response({"success": True, "available": available})
 
 
 @app.route('/api/accounts/<int:account_id>/test', methods=['GET'])
 def test_account(account_id):
     """测试账号JWT获取"""
     if account_id < 0 or account_id >= len(account_manager.accounts):
-        return jsonify({"error": "账号不存在"}), 404
+        return json_response({"error": "账号不存在"}, 404)
     
     account = account_manager.accounts[account_id]
     proxy = account_manager.config.get("proxy")
     
     try:
         jwt = get_jwt_for_account(account, proxy)
-        return jsonify({"success": True, "message": "JWT获取成功"})
+        return json_response({"success": True, "message": "JWT获取成功"})
     except Exception as e:
-        return jsonify({"success": False, "message": str(e)})
+        return json_response({"success": False, "message": str(e)})
 
 
 @app.route('/api/models', methods=['GET'])
 def get_models_config():
     """获取模型配置"""
     models = account_manager.config.get("models", [])
-    return jsonify({"models": models})
+    return json_response({"models": models})
 
 
 @app.route('/api/models', methods=['POST'])
@@ -1513,55 +2002,45 @@ def add_model():
         "enabled": data.get("enabled", True)
     }
     
-    if "models" not in account_manager.config:
-        account_manager.config["models"] = []
-    
-    account_manager.config["models"].append(new_model)
-    account_manager.save_config()
+    account_manager.config.setdefault("models", []).append(new_model)
+    account_manager.models_by_id.setdefault(new_model["id"], new_model)
+    account_manager.schedule_save()
     
-    return jsonify({"success": True})
+    return json_response({"success": True})
 
 
 @app.route('/api/models/<model_id>', methods=['PUT'])
 def update_model(model_id):
     """更新模型"""
-    models = account_manager.config.get("models", [])
-    for model in models:
-        if model.get("id") == model_id:
-            data = request.json
-            if "name" in data:
-                model["name"] = data["name"]
-            if "description" in data:
-                model["description"] = data["description"]
-            if "context_length" in data:
-                model["context_length"] = data["context_length"]
-            if "max_tokens" in data:
-                model["max_tokens"] = data["max_tokens"]
-            if "enabled" in data:
-                model["enabled"] = data["enabled"]
-            account_manager.save_config()
-            return jsonify({"success": True})
-    
-    return jsonify({"error": "模型不存在"}), 404
+    model = account_manager.models_by_id.get(model_id)
+    if model is None:
+        return json_response({"error": "模型不存在"}, 404)
+    
+    data = request.json
+    model.update({k: v for k, v in data.items() if k in _MODEL_FIELDS})
+    account_manager.schedule_save()
+    return json_response({"success": True})
 
 
 @app.route('/api/models/<model_id>', methods=['DELETE'])
 def delete_model(model_id):
     """删除模型"""
-    models = account_manager.config.get("models", [])
-    for i, model in enumerate(models):
-        if model.get("id") == model_id:
-            models.pop(i)
-            account_manager.save_config()
-            return jsonify({"success": True})
+    model = account_manager.models_by_id.get(model_id)
+    if model is None:
+        return json_response({"error": "模型不存在"}, 404)
     
-    return jsonify({"error": "模型不存在"}), 404
+    models = account_manager.config["models"]
+    models.pop(next(i for i, m in enumerate(models) if m is model))
+    # 可能存在同ID的后续模型，重建索引使其生效
+    account_manager.rebuild_models_index()
+    account_manager.schedule_save()
+    return json_response({"success": True})
 
 
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """获取完整配置"""
-    return jsonify(account_manager.config)
+    return stream_json_object(account_manager.config)
 
 
 @app.route('/api/config', methods=['PUT'])
@@ -1570,8 +2049,9 @@ def update_config():
     data = request.json
     if "proxy" in data:
         account_manager.config["proxy"] = data["proxy"]
-    account_manager.save_config()
-    return jsonify({"success": True})
+        account_manager.invalidate_proxy_status()
+    account_manager.schedule_save()
+    return json_response({"success": True})
 
 
 @app.route('/api/config/import', methods=['POST'])
@@ -1580,21 +2060,13 @@ def import_config():
     try:
         data = request.json
         account_manager.config = data
-        account_manager.accounts = data.get("accounts", [])
-        # 重建账号状态
-        account_manager.account_states = {}
-        for i, acc in enumerate(account_manager.accounts):
-            available = acc.get("available", True)
-            account_manager.account_states[i] = {
-                "jwt": None,
-                "jwt_time": 0,
-                "session": None,
-                "available": available
-            }
-        account_manager.save_config()
-        return jsonify({"success": True})
+        account_manager.reset_accounts()
+        account_manager.rebuild_models_index()
+        account_manager.invalidate_proxy_status()
+        account_manager.schedule_save()
+        return json_response({"success": True})
     except Exception as e:
-        return jsonify({"error": str(e)}), 400
+        return json_response({"error": str(e)}, 400)
 
 
 @app.route('/api/proxy/test', methods=['POST'])
@@ -1604,10 +2076,11 @@ def test_proxy():
     proxy_url = data.get("proxy") or account_manager.config.get("proxy")
     
     if not proxy_url:
-        return jsonify({"success": False, "message": "未配置代理地址"})
+        return json_response({"success": False, "message": "未配置代理地址"})
     
-    available = check_proxy(proxy_url)
-    return jsonify({
+    # 手动测试的结果同样写入缓存，状态接口可直接复用
+    available = account_manager.check_proxy_now(proxy_url)
+    return json_response({
         "success": available,
         "message": "代理可用" if available else "代理不可用或连接超时"
     })
@@ -1618,10 +2091,10 @@ def get_proxy_status():
     """获取代理状态"""
     proxy = account_manager.config.get("proxy")
     if not proxy:
-        return jsonify({"enabled": False, "url": None, "available": False})
+        return json_response({"enabled": False, "url": None, "available": False})
     
-    available = check_proxy(proxy)
-    return jsonify({
+    available = account_manager.get_proxy_available()
+    return json_response({
         "enabled": True,
         "url": proxy,
         "available": available
@@ -1631,7 +2104,7 @@ def get_proxy_status():
 @app.route('/api/config/export', methods=['GET'])
 def export_config():
     """导出配置"""
-    return jsonify(account_manager.config)
+    return stream_json_object(account_manager.config)
 
 
 def print_startup_info():
@@ -1658,8 +2131,12 @@ def print_startup_info():
     print(f"\n[代理配置]")
     print(f"  地址: {proxy or '未配置'}")
     if proxy:
-        proxy_available = check_proxy(proxy)
-        print(f"  状态: {'✓ 可用' if proxy_available else '✗ 不可用'}")
+        # 代理由后台线程检测，只短暂等待首次结果
+        proxy_available = account_manager.wait_proxy_status(PROXY_STARTUP_WAIT)
+        if proxy_available is None:
+            print("  状态: 检测中...")
+        else:
+            print(f"  状态: {'✓ 可用' if proxy_available else '✗ 不可用'}")
     
     # 图片缓存信息
     print(f"\n[图片缓存]")
@@ -1672,8 +2149,8 @@ def print_startup_info():
     print(f"  总数量: {total}")
     print(f"  可用数量: {available}")
     
-    for i, acc in enumerate(account_manager.accounts):
-        status = "✓" if account_manager.account_states.get(i, {}).get("available", True) else "✗"
+    for i, (acc, state) in enumerate(zip(account_manager.accounts, account_manager.account_states)):
+        status = "✓" if state["available"] else "✗"
         team_id = acc.get("team_id", "未知") + "..."
         print(f"  [{i}] {status} team_id: {team_id}")
     
@@ -1696,6 +2173,10 @@ def print_startup_info():
     print("启动服务...")
 
 
+# 模块内函数均已定义后再启动后台清理线程（以WSGI方式导入时同样生效）
+threading.Thread(target=_image_sweeper, name="image-sweeper", daemon=True).start()
+
+
 if __name__ == '__main__':
     print_startup_info()
     